@@ -72,7 +72,7 @@ def plot_returns(data):
 
 tickers = ['TSLA', 'QQQ', 'AAPL']
 period = '5y'
-data = yf.download(tickers, period=period)["Adj Close"]
+data = yf.download(tickers, period=period, auto_adjust=True)["Close"]
 plot_returns(data)
 plot_drawdowns(data)
 
@@ -1,129 +1,300 @@
+import os
 import re
+import hashlib
+import tempfile
+import functools
+import threading
+from concurrent.futures import Future
 import click
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from pathlib import Path
 from dateutil.relativedelta import relativedelta
-from dateutil import parser
-import yfinance
-import matplotlib.pyplot as plt
-import mplcursors
+from platformdirs import user_cache_dir
 
 # TODO: If time > 1 year, display CAGR
 
+CACHE_DIR = Path(user_cache_dir("grynn_fplot"))
+MAX_PLOT_POINTS = 2000
+
+# unit aliases accepted in offsets like "3 mos ago", grouped by relativedelta keyword
+_UNIT_ALIASES = {
+    "months": ["m", "mo", "mos", "mth", "mths", "month", "months"],
+    "days": ["d", "day", "days"],
+    "years": ["y", "yr", "yrs", "year", "years"],
+    "weeks": ["w", "wk", "wks", "week", "weeks"],
+}
+_UNIT_KW = {alias: kw for kw, aliases in _UNIT_ALIASES.items() for alias in aliases}
+
+# alternation is built from _UNIT_KW (longest alias first) so the pattern and the table cannot drift apart
+_OFFSET_RE = re.compile(r"^(?:last\s*)?(\d+)\s*(" + "|".join(sorted(_UNIT_KW, key=len, reverse=True)) + r")\s*(?:ago)?$",
+                        re.IGNORECASE)
+
+## correct common mistakes
+## acceptable intervals are 1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo
+_INTERVAL_ALIAS = {"1w": "1wk", "3m": "3mo", "day": "1d", "week": "1wk", "month": "1mo"}
+
+# how long a cached download stays fresh, counted from when it was written: the latest bar keeps
+# moving while the market is open, so nothing is reused for more than 15 minutes, or one bar for
+# intervals shorter than that
+_CACHE_TTL = {
+    "1m": timedelta(minutes=1), "2m": timedelta(minutes=2), "5m": timedelta(minutes=5),
+    "15m": timedelta(minutes=15), "30m": timedelta(minutes=15), "60m": timedelta(minutes=15),
+    "90m": timedelta(minutes=15), "1h": timedelta(minutes=15),
+    "1d": timedelta(minutes=15), "5d": timedelta(minutes=15), "1wk": timedelta(minutes=15),
+    "1mo": timedelta(minutes=15), "3mo": timedelta(minutes=15),
+}
+_DEFAULT_CACHE_TTL = timedelta(minutes=15)
+# the key includes the start date, so the default "1 year ago" makes a new file every day; prune old ones
+_CACHE_MAX_AGE = timedelta(days=1)
+
 def parse_start_date(date_or_offset) -> datetime:
     if date_or_offset is None:
         return datetime.now() - relativedelta(years=1)
     elif isinstance(date_or_offset, str):
-        if date_or_offset.upper() == "YTD":
-            return datetime(datetime.now().year, 1, 1)
-        elif re.match(r"^(?:last\s*)?(\d+)\s*(m|mos|mths|mo|months|days|d|yrs|y|weeks?|wks?|wk)\s*(?:ago)?$", date_or_offset):
-            match = re.match(r"^(?:last\s*)?(\d+)\s*(m|mos|mths|mo|months|days|d|yrs|y|weeks?|wks?|wk)\s*(?:ago)?$", date_or_offset)
-            num = int(match.group(1))
-            unit = match.group(2)
-            if unit in ["m", "mo", "mos", "mths", "months"]:
-                return datetime.now() - relativedelta(months=num)
-            elif unit in ["d", "days"]:
-                return datetime.now() - relativedelta(days=num)
-            elif unit in ["y", "yrs"]:
-                return datetime.now() - relativedelta(years=num)
-            elif unit in ["w", "wk", "wks", "week", "weeks"]:
-                return datetime.now() - relativedelta(weeks=num)
-            else:
-                raise ValueError(f"Invalid unit: {unit} in expression {date_or_offset}")
-        else:
-            try:
-                import dateparser
-                parsed_date = dateparser.parse(date_or_offset)
-                if parsed_date is None:
-                    raise ValueError(f"Invalid date '{date_or_offset}'")
-                return parsed_date
-            except Exception as e:
-                raise ValueError(f"Invalid date '{date_or_offset}'")
+        # strip first so " 3m " takes the regex path and shares a cache entry with "3m"
+        return _parse_date_string(date_or_offset.strip(), date.today().toordinal())
     elif isinstance(date_or_offset, datetime):
         return date_or_offset
     else:
         raise ValueError(f"Invalid date '{date_or_offset}'")
 
-def generate_plots(tickers, since, interval="1d"):
-    """Generate df with price plot, drawdown plot, and if needed rolling CAGR"""
-    pass
-
-@click.command("plot")
-@click.option("--since", type=str, default=None)
-@click.option("--interval", type=str, default="1d")
-@click.argument("ticker", type=str, nargs=1, required=True)
-def display_plot(ticker, since, interval="1mo"):
-    """Generate a plot of the given ticker(s)"""
-    if (since is None):
-        since = datetime.now() - relativedelta(years=1)
+@functools.lru_cache(maxsize=256)
+def _parse_date_string(date_or_offset: str, today: int) -> datetime:
+    # `today` (an ordinal) is only part of the cache key: "3m" or "YTD" mean something else tomorrow
+    if date_or_offset.upper() == "YTD":
+        return datetime(datetime.now().year, 1, 1)
+    elif match := _OFFSET_RE.match(date_or_offset):
+        return datetime.now() - relativedelta(**{_UNIT_KW[match.group(2).lower()]: int(match.group(1))})
     else:
-        since = parse_start_date(since)
+        try:
+            import dateparser
+            parsed_date = dateparser.parse(date_or_offset)
+            if parsed_date is None:
+                raise ValueError(f"Invalid date '{date_or_offset}'")
+            return parsed_date
+        except Exception as e:
+            raise ValueError(f"Invalid date '{date_or_offset}'")
 
-    if isinstance(ticker, str):
-        tickers = [*ticker.split(",")]
-    
-    tickers = list(set(tickers))
-    if len(tickers) == 1: tickers.append("SPY")
-
-    ## correct common mistakes
-    ## acceptable intervals are 1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo
-    ## if interval = 1w, map to 1wk
-    if interval == "1w": interval = "1wk"
-    if re.match(r"3m$", interval): interval = "3mo"
-    if interval == "day": interval = "1d"
-    if interval == "week": interval = "1wk"
-    if interval == "month": interval = "1mo"
+def parse_tickers(ticker: str, benchmark="SPY") -> list:
+    """Split a comma separated ticker list into unique upper-case tickers (keeping their order), adding the benchmark to a lone ticker"""
+    tickers = list(dict.fromkeys(t.strip().upper() for t in ticker.split(",") if t.strip()))
+    if len(tickers) == 1 and benchmark and tickers[0] != benchmark:
+        tickers.append(benchmark)
+    return tickers
 
-    click.echo(f"Generating plot for {','.join(tickers)} since {since.date()}. Interval: {interval}")
+def _cache_path(tickers, since, interval) -> Path:
+    key = repr((tuple(sorted(tickers)), str(since.date()), interval))
+    return CACHE_DIR / f"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}.pkl"
 
-    df = yfinance.download(tickers, start=since, interval=interval)["Adj Close"]
-    
+def _cache_is_fresh(cache_file, interval) -> bool:
+    """True if cache_file was written less than the interval's TTL (see _CACHE_TTL) ago"""
+    modified = datetime.fromtimestamp(cache_file.stat().st_mtime)
+    return datetime.now() - modified < _CACHE_TTL.get(interval, _DEFAULT_CACHE_TTL)
+
+def _prune_cache():
+    """Delete cache files (and temp files orphaned by a killed write) older than _CACHE_MAX_AGE"""
+    cutoff = (datetime.now() - _CACHE_MAX_AGE).timestamp()
+    for path in [*CACHE_DIR.glob("*.pkl"), *CACHE_DIR.glob("*.tmp")]:
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass  # already removed by a concurrent run
+
+def download_ticker_data(tickers, since, interval="1d"):
+    """Download (split and dividend) adjusted close prices, reusing a recent copy cached on disk (see _cache_is_fresh)
+
+    Set FPLOT_NO_CACHE=1 to bypass the cache entirely (neither read nor written).
+    """
+    import pandas as pd
+    use_cache = os.environ.get("FPLOT_NO_CACHE") != "1"
+    cache_file = _cache_path(tickers, since, interval)
+    if use_cache and cache_file.exists() and _cache_is_fresh(cache_file, interval):
+        try:
+            return pd.read_pickle(cache_file)
+        except Exception:
+            # unreadable (truncated or corrupt): treat as a miss, the fresh download below replaces it
+            cache_file.unlink(missing_ok=True)
+
+    import yfinance
+    df = yfinance.download(tickers, start=since, interval=interval, auto_adjust=True)["Close"]
+    if isinstance(df, pd.Series):
+        # yfinance releases before multi_level_index return flat columns for a single ticker
+        df = df.to_frame(tickers[0])
+    if use_cache and not df.empty:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file next to the target and rename it into place, so an interrupted
+        # write (Ctrl-C, full disk) never leaves a partial pickle that looks like a fresh cache entry
+        fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                df.to_pickle(tmp)
+            os.replace(tmp_name, cache_file)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        _prune_cache()
+    return df
+
+@functools.cache
+def _palette() -> tuple:
+    from matplotlib import colormaps
+    return colormaps["tab10"].colors
+
+def _ticker_colors(tickers, benchmark="SPY"):
+    """Generate color mapping for tickers, assign the benchmark to gray (palette wraps around past 10 tickers)"""
+    palette = _palette()
+    others = [t for t in tickers if t != benchmark]
+    assign = {t: palette[i % len(palette)] for i, t in enumerate(others)}
+    return ["darkgrey" if t == benchmark else assign[t] for t in tickers]
+
+def _drawdown_array(arr):
+    import numpy as np
+    out = np.empty_like(arr)
+    np.divide(arr, np.fmax.accumulate(arr, axis=0), out=out)
+    out -= 1.0
+    return out
+
+def normalize_and_drawdown(df, start=100):
+    """Rescale each column of df to start at `start` (so tickers can be compared), and return that
+    frame with the drawdown of each column from its running peak (0 at a new high, -0.25 when 25% below it)"""
+    import numpy as np
+    import pandas as pd
+    arr = df.to_numpy(dtype=np.float64)
+    normalized = arr * (start / arr[0])
+    return (pd.DataFrame(normalized, index=df.index, columns=df.columns),
+            pd.DataFrame(_drawdown_array(normalized), index=df.index, columns=df.columns))
+
+def _downsample_positions(values, n_out=MAX_PLOT_POINTS):
+    """At most n_out row positions that keep every column's min and max in each bucket of rows (plus the ends)"""
+    import numpy as np
+    n, n_cols = values.shape
+    # each bucket contributes up to two rows per column (its min and max), the ends two more
+    n_buckets = max((n_out - 2) // (2 * n_cols), 1)
+    bucket = -(-n // n_buckets)
+    # pad the last, partial bucket with NaN rows; positions landing on the padding are clipped back below
+    padded = np.full((-(-n // bucket) * bucket, n_cols), np.nan)
+    padded[:n] = values
+    buckets = padded.reshape(-1, bucket, n_cols)
+    starts = np.arange(buckets.shape[0])[:, None] * bucket
+    nan = np.isnan(buckets)
+    lows = np.where(nan, np.inf, buckets).argmin(axis=1) + starts
+    highs = np.where(nan, -np.inf, buckets).argmax(axis=1) + starts
+    return np.unique(np.minimum(np.concatenate([lows.ravel(), highs.ravel(), [0, n - 1]]), n - 1))
+
+def _run_in_background(fn, *args) -> Future:
+    """Run fn(*args) on a daemon thread and return a Future for its result
+
+    Unlike a ThreadPoolExecutor worker, a daemon thread is not joined at exit, so Ctrl-C while
+    waiting on the result aborts at once instead of after a slow (or hung) download finishes.
+    """
+    future = Future()
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def _is_interactive_backend() -> bool:
+    import matplotlib
+    from matplotlib.backends import backend_registry, BackendFilter
+    non_interactive = backend_registry.list_builtin(BackendFilter.NON_INTERACTIVE)
+    return matplotlib.get_backend().lower() not in non_interactive
+
+def _annotate_selection(sel):
+    """mplcursors callback: label the picked point with its ticker, in the line's color"""
+    sel.annotation.set_text(f"{sel.artist.get_label()}: {sel.target[1]:.2f}")
+    sel.annotation.set_color(sel.artist.get_color())
+
+def render_price_and_drawdown(df, tickers, since, interval, benchmark="SPY"):
+    """Plot normalized prices (top) and drawdowns (bottom) for the price frame df and show the figure"""
+    import numpy as np
     #Normalize the price data (so we can compare them, all tickers start at $100)
-    df = df.div(df.iloc[0]).mul(100)
-    df_dd = df.div(df.cummax()).sub(1)    
+    df, df_dd = normalize_and_drawdown(df)
 
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(16, 12), sharex=True)
+    # Thin out long intraday series, keeping each bucket's extremes so peaks and troughs survive
+    if len(df) > 2 * MAX_PLOT_POINTS:
+        positions = _downsample_positions(np.hstack([df.to_numpy(), df_dd.to_numpy()]))
+        df, df_dd = df.iloc[positions], df_dd.iloc[positions]
+
+    # Deferred so that e.g. `fplot --help` doesn't pay for importing the plotting stack
+    import matplotlib.pyplot as plt
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter, date2num
 
-    # Generate color mapping, assign 'SPY' to gray
-    tickers_in_df = df.columns.tolist()
-    color_map = plt.get_cmap('tab10')
-    color_iter = iter(color_map.colors)
-    colors = []
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(16, 12), sharex=True)
+    # x axis is shared, so one locator/formatter pair serves both panes
+    locator = AutoDateLocator()
+    ax2.xaxis.set_major_locator(locator)
+    ax2.xaxis.set_major_formatter(ConciseDateFormatter(locator))
 
-    for t in tickers_in_df:
-        if t == 'SPY':
-            colors.append('darkgrey')
-        else:
-            colors.append(next(color_iter))
+    colors = _ticker_colors(df.columns.tolist(), benchmark)
+    # Convert the dates to matplotlib's float days once; both panes, the xlim and the annotations share them
+    x = date2num(df.index)
+    ax1.xaxis_date()
 
-    # Plot the normalized price data with specified colors
-    df.plot(ax=ax1, color=colors)
+    # Plot the normalized price data with specified colors (one Line2D per column, created in a single call)
+    labels = df.columns.tolist()
+    ax1.set_prop_cycle(color=colors)
+    ax1.plot(x, df.to_numpy(), label=labels)
+    ax1.set_xlim(x[0], x[-1])
+    ax1.legend()
     ax1.set_title(f"{','.join(tickers)} Price")
     ax1.set_ylabel("Normalized Price")
 
     # Plot the drawdowns with the same colors
-    df_dd.plot(ax=ax2, color=colors)
+    ax2.set_prop_cycle(color=colors)
+    ax2.plot(x, df_dd.to_numpy(), label=labels)
+    ax2.legend()
     ax2.set_title(f"{','.join(tickers)} Drawdowns")
     ax2.set_ylabel("Drawdown")
     ax2.set_xlabel(f"from {since.date()} to {datetime.now().date()} in {interval} intervals")
 
-    # Add annotations with text color matching line color
-    for line in ax1.get_lines():
-        y = line.get_ydata()[-1]
-        x = line.get_xdata()[-1]
-        label = line.get_label()
-        ax1.annotate(f"{label}: {y-100:.2f}%", xy=(x, y), color=line.get_color())
-
-    # Add interactive features
-    mplcursors.cursor(ax1).connect("add", lambda sel: (
-        sel.annotation.set_text(f"{sel.artist.get_label()}: {sel.target[1]:.2f}"),
-        sel.annotation.set_color(sel.artist.get_color())
-    ))
-    mplcursors.cursor(ax2).connect("add", lambda sel: (
-        sel.annotation.set_text(f"{sel.artist.get_label()}: {sel.target[1]:.2f}"),
-        sel.annotation.set_color(sel.artist.get_color())
-    ))
+    # Add annotations with text color matching line color (read the last row directly, not each line's data)
+    last_x, last_y = x[-1], df.to_numpy()[-1]
+    for label, y, color in zip(labels, last_y, colors):
+        change = f"{y-100:.2f}%" if np.isfinite(y) else "N/A"
+        ax1.annotate(f"{label}: {change}", xy=(last_x, y), color=color)
+
+    # Add interactive features (pointless when the figure can't be shown, e.g. headless/Agg)
+    if _is_interactive_backend():
+        import mplcursors
+        mplcursors.cursor([ax1, ax2]).connect("add", _annotate_selection)
     
     plt.tight_layout()
     plt.show()
-    return
+
+@click.command("plot")
+@click.option("--since", type=str, default=None)
+@click.option("--interval", type=str, default="1d")
+@click.option("--benchmark", type=str, default="SPY", help="Ticker added to a lone ticker for comparison ('none' to skip)")
+@click.argument("ticker", type=str, nargs=1, required=True)
+def display_plot(ticker, since, interval="1mo", benchmark="SPY"):
+    """Generate a plot of the given ticker(s)"""
+    if (since is None):
+        since = datetime.now() - relativedelta(years=1)
+    else:
+        since = parse_start_date(since)
+
+    import numpy as np
+
+    benchmark = None if benchmark.strip().lower() in ("", "none") else benchmark.strip().upper()
+    tickers = parse_tickers(ticker, benchmark)
+
+    interval = _INTERVAL_ALIAS.get(interval, interval)
+
+    click.echo(f"Generating plot for {','.join(tickers)} since {since.date()}. Interval: {interval}")
+
+    # Import the plotting stack on this (GUI) thread while the download is in flight
+    download = _run_in_background(download_ticker_data, tickers, since, interval)
+    import matplotlib.pyplot  # noqa: F401
+    df = download.result()
+
+    # Yahoo often has no quote yet for some tickers on the latest bar; don't plot that partial row
+    if len(df) > 1 and np.isnan(df.to_numpy()[-1]).any():
+        click.echo(f"Dropping incomplete last row ({df.index[-1]})")
+        df = df.iloc[:-1]
+
+    render_price_and_drawdown(df, tickers, since, interval, benchmark)
 
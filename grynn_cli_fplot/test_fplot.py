@@ -1,6 +1,18 @@
+import os
 import unittest
-from datetime import datetime
-from .fplot import parse_start_date
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+from . import fplot
+from .fplot import parse_start_date, parse_tickers, download_ticker_data, _ticker_colors, _downsample_positions, normalize_and_drawdown
+from .fplot import render_price_and_drawdown, display_plot
 
 class TestParseDate(unittest.TestCase):
 
@@ -19,6 +31,11 @@ class TestParseDate(unittest.TestCase):
             self.assertIsInstance(result, datetime)
             self.assertEqual(result.date(), r1.date())
 
+    def test_offset_case_insensitive(self):
+        r1 = parse_start_date("last 3 months")
+        for test_string in ["Last 3 Months", "3M", "3MTHS AGO"]:
+            self.assertEqual(parse_start_date(test_string).date(), r1.date())
+
     def test_last_10_days(self):
         result = parse_start_date("last 10 days")
         self.assertIsInstance(result, datetime)
@@ -38,10 +55,21 @@ class TestParseDate(unittest.TestCase):
         result = parse_start_date("last 4 weeks")
         self.assertIsInstance(result, datetime)
 
+    def test_every_unit_alias_parses(self):
+        for alias in fplot._UNIT_KW:
+            self.assertIsInstance(parse_start_date(f"last 2 {alias}"), datetime)
+        self.assertEqual(parse_start_date("4w").date(), parse_start_date("4 weeks").date())
+        self.assertEqual(parse_start_date("1 year").date(), parse_start_date("1y").date())
+        self.assertEqual(parse_start_date("last 1 month").date(), parse_start_date("1m").date())
+
     def test_invalid_unit(self):
         with self.assertRaises(ValueError):
             parse_start_date("last 5 xyz")
 
+    def test_string_parses_are_cached(self):
+        self.assertIs(parse_start_date("last 6 months"), parse_start_date("last 6 months"))
+        self.assertIs(parse_start_date(" last 6 months "), parse_start_date("last 6 months"))
+
     def test_datetime_object(self):
         date = datetime(2020, 1, 1)
         self.assertEqual(parse_start_date(date), date)
@@ -57,6 +85,290 @@ class TestParseDate(unittest.TestCase):
             parse_start_date("invalid date")
 
 
+class TestParseTickers(unittest.TestCase):
+
+    def test_order_preserved_and_deduplicated(self):
+        self.assertEqual(parse_tickers("tsla, AAPL,TSLA,,msft"), ["TSLA", "AAPL", "MSFT"])
+
+    def test_single_ticker_gets_spy(self):
+        self.assertEqual(parse_tickers("aapl"), ["AAPL", "SPY"])
+        self.assertEqual(parse_tickers("SPY"), ["SPY"])
+
+    def test_benchmark_is_configurable(self):
+        self.assertEqual(parse_tickers("aapl", benchmark="QQQ"), ["AAPL", "QQQ"])
+        self.assertEqual(parse_tickers("aapl", benchmark=None), ["AAPL"])
+
+
+class _FakeYfinance:
+    """Stands in for the yfinance module, so these tests never import (or call out to) the real one"""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def download(self, *args, **kwargs):
+        self.calls += 1
+        return self.result
+
+class TestDownloadCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # built once and shared: download_ticker_data only reads (and pickles) the frame
+        prices = pd.DataFrame({"AAPL": [100.0, 101.0, 99.0], "SPY": [400.0, 402.0, 401.0]},
+                              index=pd.date_range("2024-01-02", periods=3, freq="D"))
+        cls.download_result = pd.concat({"Close": prices}, axis=1)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache_dir = patch.object(fplot, "CACHE_DIR", Path(tmp.name))
+        cache_dir.start()
+        self.addCleanup(cache_dir.stop)
+
+        self.yfinance = _FakeYfinance(self.download_result)
+        fake_module = patch.dict(sys.modules, yfinance=self.yfinance)
+        fake_module.start()
+        self.addCleanup(fake_module.stop)
+
+    def test_second_download_is_cached(self):
+        since = datetime(2024, 1, 1)
+        df1 = download_ticker_data(["AAPL", "SPY"], since)
+        df2 = download_ticker_data(["SPY", "AAPL"], since)
+        self.assertEqual(self.yfinance.calls, 1)
+        pd.testing.assert_frame_equal(df1, df2)
+
+    def test_corrupt_cache_file_is_refetched(self):
+        since = datetime(2024, 1, 1)
+        cache_file = fplot._cache_path(["AAPL", "SPY"], since, "1d")
+        expected = download_ticker_data(["AAPL", "SPY"], since)
+        cache_file.write_bytes(cache_file.read_bytes()[:20])  # as left by an interrupted write
+        pd.testing.assert_frame_equal(download_ticker_data(["AAPL", "SPY"], since), expected)
+        pd.testing.assert_frame_equal(pd.read_pickle(cache_file), expected)
+        self.assertEqual(self.yfinance.calls, 2)
+
+    def test_cache_write_leaves_no_temp_files(self):
+        download_ticker_data(["AAPL", "SPY"], datetime(2024, 1, 1))
+        self.assertEqual([p.suffix for p in fplot.CACHE_DIR.iterdir()], [".pkl"])
+
+    def test_single_ticker_flat_columns(self):
+        self.yfinance.result = pd.DataFrame({"Close": [100.0, 101.0], "Volume": [10, 20]},
+                                            index=pd.date_range("2024-01-02", periods=2, freq="D"))
+        df = download_ticker_data(["AAPL"], datetime(2024, 1, 1))
+        self.assertEqual(df.columns.tolist(), ["AAPL"])
+        normalized, _ = normalize_and_drawdown(df)
+        self.assertEqual(normalized["AAPL"].iloc[-1], 101.0)
+
+    def test_old_cache_files_are_pruned(self):
+        old, recent = fplot.CACHE_DIR / "old.pkl", fplot.CACHE_DIR / "recent.pkl"
+        for path in (old, recent):
+            path.write_bytes(b"")
+        two_days_ago = (datetime.now() - timedelta(days=2)).timestamp()
+        os.utime(old, (two_days_ago, two_days_ago))
+        download_ticker_data(["AAPL", "SPY"], datetime(2024, 1, 1))
+        self.assertFalse(old.exists())
+        self.assertTrue(recent.exists())
+        self.assertTrue(fplot._cache_path(["AAPL", "SPY"], datetime(2024, 1, 1), "1d").exists())
+
+    def test_no_cache_env_var(self):
+        since = datetime(2024, 1, 1)
+        with patch.dict(os.environ, {"FPLOT_NO_CACHE": "1"}):
+            download_ticker_data(["AAPL", "SPY"], since)
+            download_ticker_data(["AAPL", "SPY"], since)
+        self.assertEqual(self.yfinance.calls, 2)
+        self.assertEqual(list(fplot.CACHE_DIR.iterdir()), [])
+
+    def test_daily_cache_expires(self):
+        since = datetime(2024, 1, 1)
+        download_ticker_data(["AAPL", "SPY"], since, "1d")
+        cache_file = next(fplot.CACHE_DIR.iterdir())
+        stale = (datetime.now() - fplot._CACHE_TTL["1d"] - timedelta(minutes=1)).timestamp()
+        os.utime(cache_file, (stale, stale))
+        download_ticker_data(["AAPL", "SPY"], since, "1d")
+        download_ticker_data(["AAPL", "SPY"], since, "1d")
+        self.assertEqual(self.yfinance.calls, 2)
+
+    def test_intraday_cache_expires(self):
+        since = datetime(2024, 1, 1)
+        # 60m bars still go stale after 15 minutes: the forming bar (and the next one) keep changing
+        for interval, age in [("5m", timedelta(minutes=10)), ("60m", timedelta(minutes=20))]:
+            with self.subTest(interval=interval):
+                calls = self.yfinance.calls
+                download_ticker_data(["AAPL", "SPY"], since, interval)
+                cache_file = fplot._cache_path(["AAPL", "SPY"], since, interval)
+                stale = (datetime.now() - age).timestamp()
+                os.utime(cache_file, (stale, stale))
+                download_ticker_data(["AAPL", "SPY"], since, interval)
+                download_ticker_data(["AAPL", "SPY"], since, interval)
+                self.assertEqual(self.yfinance.calls - calls, 2)
+
+    def test_cache_key_includes_interval(self):
+        since = datetime(2024, 1, 1)
+        download_ticker_data(["AAPL", "SPY"], since, "1d")
+        download_ticker_data(["AAPL", "SPY"], since, "1wk")
+        self.assertEqual(self.yfinance.calls, 2)
+
+class TestTickerColors(unittest.TestCase):
+
+    def test_spy_is_grey(self):
+        colors = _ticker_colors(["AAPL", "SPY", "TSLA"])
+        self.assertEqual(colors[1], "darkgrey")
+        self.assertNotEqual(colors[0], colors[2])
+
+    def test_palette_wraps_for_many_tickers(self):
+        tickers = [f"T{i}" for i in range(12)] + ["SPY"]
+        colors = _ticker_colors(tickers)
+        self.assertEqual(len(colors), len(tickers))
+        self.assertEqual(colors[10], colors[0])
+        self.assertEqual(colors[-1], "darkgrey")
+
+    def test_spy_does_not_consume_palette(self):
+        self.assertEqual(_ticker_colors(["SPY", "AAPL"])[1], _ticker_colors(["AAPL"])[0])
+
+    def test_custom_benchmark_is_grey(self):
+        colors = _ticker_colors(["AAPL", "QQQ", "SPY"], benchmark="QQQ")
+        self.assertEqual(colors[1], "darkgrey")
+        self.assertNotEqual(colors[2], "darkgrey")
+
+class TestCalculations(unittest.TestCase):
+
+    def setUp(self):
+        self.prices = pd.DataFrame({"AAPL": [np.nan, 10.0, 12.0, 9.0, 15.0], "SPY": [100.0, 90.0, np.nan, 110.0, 99.0]},
+                                   index=pd.date_range("2024-01-01", periods=5, freq="D"))
+
+    def test_normalize_matches_pandas(self):
+        expected = self.prices.div(self.prices.iloc[0]).mul(100)
+        pd.testing.assert_frame_equal(normalize_and_drawdown(self.prices)[0], expected)
+        self.assertEqual(normalize_and_drawdown(self.prices, start=1)[0]["SPY"].iloc[-1], 0.99)
+
+    def test_drawdowns_match_pandas(self):
+        normalized = self.prices.div(self.prices.iloc[0]).mul(100)
+        expected = normalized.div(normalized.cummax()).sub(1)
+        pd.testing.assert_frame_equal(normalize_and_drawdown(self.prices)[1], expected)
+        self.assertAlmostEqual(expected["SPY"].iloc[-1], -0.1)
+
+
+class TestDownsample(unittest.TestCase):
+
+    def test_keeps_extremes_and_ends(self):
+        rng = np.random.default_rng(0)
+        values = rng.standard_normal((10_001, 2)).cumsum(axis=0)
+        values[:50, 1] = np.nan
+        positions = _downsample_positions(values, n_out=200)
+
+        self.assertLessEqual(len(positions), 200)
+        self.assertEqual(positions[0], 0)
+        self.assertEqual(positions[-1], len(values) - 1)
+        for col in range(values.shape[1]):
+            self.assertIn(np.nanargmin(values[:, col]), positions)
+            self.assertIn(np.nanargmax(values[:, col]), positions)
+
+    def test_budget_holds_for_many_columns(self):
+        rng = np.random.default_rng(1)
+        for n_rows, n_cols in [(11_700, 4), (11_700, 20), (4_001, 4), (2_345, 7)]:
+            values = rng.standard_normal((n_rows, n_cols)).cumsum(axis=0)
+            positions = _downsample_positions(values, n_out=2000)
+            self.assertLessEqual(len(positions), 2000)
+            self.assertEqual((positions[0], positions[-1]), (0, n_rows - 1))
+            self.assertIn(np.argmax(values[:, -1]), positions)
+
+class TestRender(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg")  # headless, and non-interactive so no mplcursors cursor is expected
+        cls.plt = plt
+
+    def setUp(self):
+        self.addCleanup(self.plt.close, "all")
+        rng = np.random.default_rng(0)
+        rows = 2 * fplot.MAX_PLOT_POINTS + 500
+        self.prices = pd.DataFrame(100 * np.exp(rng.normal(0, 0.01, (rows, 2)).cumsum(axis=0)),
+                                   columns=["AAPL", "SPY"], index=pd.date_range("2024-01-02", periods=rows, freq="h"))
+        self.prices["GONE"] = np.nan
+
+    def render(self):
+        with patch("matplotlib.pyplot.show") as show, patch("mplcursors.cursor") as cursor:
+            render_price_and_drawdown(self.prices, ["AAPL", "SPY", "GONE"], datetime(2024, 1, 1), "1h")
+        show.assert_called_once()
+        cursor.assert_not_called()
+        return self.plt.gcf().axes
+
+    def test_lines_colors_and_downsampling(self):
+        from matplotlib.colors import to_rgba
+        from matplotlib.dates import date2num
+        ax1, ax2 = self.render()
+        expected_colors = [to_rgba(c) for c in _ticker_colors(["AAPL", "SPY", "GONE"])]
+        for ax in (ax1, ax2):
+            lines = ax.get_lines()
+            self.assertEqual([line.get_label() for line in lines], ["AAPL", "SPY", "GONE"])
+            self.assertEqual([to_rgba(line.get_color()) for line in lines], expected_colors)
+            x = lines[0].get_xdata()
+            self.assertLessEqual(len(x), fplot.MAX_PLOT_POINTS)
+            self.assertEqual((x[0], x[-1]), tuple(date2num(self.prices.index[[0, -1]])))
+        self.assertEqual(to_rgba(ax1.get_lines()[1].get_color()), to_rgba("darkgrey"))
+        self.assertEqual(ax1.get_xlim(), tuple(date2num(self.prices.index[[0, -1]])))
+
+    def test_last_row_annotations(self):
+        ax1, _ = self.render()
+        change = self.prices.iloc[-1] / self.prices.iloc[0] * 100 - 100
+        self.assertEqual([t.get_text() for t in ax1.texts],
+                         [f"AAPL: {change['AAPL']:.2f}%", f"SPY: {change['SPY']:.2f}%", "GONE: N/A"])
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        prices = pd.DataFrame({"AAPL": [100.0, 101.0, 102.0], "SPY": [400.0, 401.0, np.nan]},
+                              index=pd.date_range("2024-01-02", periods=3, freq="D"))
+        self.downloads = []
+        def fake_download(tickers, since, interval="1d"):
+            self.downloads.append((tickers, interval))
+            return prices[tickers]
+        download = patch.object(fplot, "download_ticker_data", side_effect=fake_download)
+        render = patch.object(fplot, "render_price_and_drawdown")
+        download.start()
+        self.render = render.start()
+        self.addCleanup(download.stop)
+        self.addCleanup(render.stop)
+
+    def test_benchmark_none_and_interval_alias(self):
+        result = CliRunner().invoke(display_plot, ["aapl", "--benchmark", "none", "--interval", "week"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.downloads, [(["AAPL"], "1wk")])
+        df, tickers, _, interval, benchmark = self.render.call_args.args
+        self.assertEqual((tickers, interval, benchmark), (["AAPL"], "1wk", None))
+        self.assertEqual(len(df), 3)
+
+    def test_default_benchmark_and_incomplete_last_row(self):
+        result = CliRunner().invoke(display_plot, ["AAPL", "--interval", "day"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.downloads, [(["AAPL", "SPY"], "1d")])
+        self.assertIn("Dropping incomplete last row", result.output)
+        df = self.render.call_args.args[0]
+        self.assertEqual(df.index[-1], pd.Timestamp("2024-01-03"))
+        self.assertFalse(df.isna().any().any())
+
+class TestRunInBackground(unittest.TestCase):
+
+    def test_result_and_exception_are_returned(self):
+        self.assertEqual(fplot._run_in_background(pow, 2, 10).result(timeout=5), 1024)
+        with self.assertRaises(ZeroDivisionError):
+            fplot._run_in_background(divmod, 1, 0).result(timeout=5)
+
+    def test_worker_does_not_block_exit(self):
+        is_daemon = fplot._run_in_background(lambda: threading.current_thread().daemon).result(timeout=5)
+        self.assertTrue(is_daemon)
+
+class TestImports(unittest.TestCase):
+
+    def test_heavy_modules_are_not_imported_eagerly(self):
+        heavy = ["numpy", "pandas", "matplotlib.pyplot", "mplcursors", "yfinance", "dateparser"]
+        code = f"import sys, grynn_cli_fplot; print([m for m in {heavy!r} if m in sys.modules])"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
 
 if __name__ == "__main__":
     unittest.main()